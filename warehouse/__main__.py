@@ -1,6 +1,9 @@
 import argparse
 import json
+import os
 import statistics
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 from bonsai_connector import BonsaiConnector
 
@@ -10,6 +13,13 @@ from warehouse.sim import Simulation
 
 parser = argparse.ArgumentParser(description="Run a simulation")
 parser.add_argument('-p', '--policy', choices=AVAILABLE_POLICIES)
+parser.add_argument(
+    '-c',
+    '--compare',
+    nargs='+',
+    choices=AVAILABLE_POLICIES,
+    help='Evaluate several policies on the same scenarios in a single run',
+)
 parser.add_argument('-g', '--generate-scenarios', action='store_true')
 parser.add_argument('-e', '--episodes', type=int, default=100)
 parser.add_argument('--scenarios', type=str)
@@ -17,6 +27,20 @@ parser.add_argument(
     '--host', type=str, default='localhost', help='Host of deployed brain'
 )
 parser.add_argument('--port', type=int, default=5000, help='Port of deployed brain')
+parser.add_argument(
+    '-o', '--output', type=str, help='File where to append per-episode results'
+)
+parser.add_argument(
+    '--checkpoint-every',
+    type=int,
+    default=100,
+    help='Number of episodes to buffer before flushing results and checkpoint',
+)
+parser.add_argument(
+    '--resume',
+    action='store_true',
+    help='Skip scenarios already evaluated according to the checkpoint of --output',
+)
 
 
 def train():
@@ -38,50 +62,236 @@ def clean_state(state):
     return cleaned_state
 
 
-def evaluate(policy, scenarios, host, port, episodes):
+def run_episode(warehouse_sim, agent, config, start_state=None):
+    """Run a scenario with the given agent and return its KPIs."""
+    state = clean_state(warehouse_sim.episode_start(config, start_state))
+    leftover = 0
+
+    for _ in range(config['total_pos']):
+        if state['available_bins'] <= 0:
+            leftover = state['remaining_products']
+            break
+        action = agent.action(state)
+        state = clean_state(warehouse_sim.episode_step(action))
+    agent.reset()
+    return {'A': state['A'], 'B': state['B'], 'leftovers': leftover}
+
+
+class Checkpoint:
+    """Aggregate evaluation results and persist progress next to the results file.
+
+    The checkpoint stores how many scenarios have been evaluated, the running
+    sums of the KPIs and the size of the results file at the time it was
+    written. On resume the results file is truncated to that size, so that
+    episodes flushed after the last checkpoint are not counted twice.
+    If no output file is given, results are only aggregated in memory.
+    """
+    def __init__(self, output, policy, scenarios):
+        self.output = output
+        self.path = f'{output}.ckpt' if output else None
+        self.policy = policy
+        self.scenarios = os.path.abspath(scenarios)
+        self.offset = 0
+        self.kpis = {'A': 0., 'B': 0., 'leftovers': 0.}
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as fp:
+                checkpoint = json.load(fp)
+        except FileNotFoundError:
+            print(f'No checkpoint found at {self.path}. Starting from scratch...')
+            open(self.output, 'w').close()
+            return
+        if (checkpoint['policy'], checkpoint['scenarios']) != (
+            self.policy, self.scenarios
+        ):
+            raise ValueError(
+                f'Checkpoint {self.path} was written for policy '
+                f'"{checkpoint["policy"]}" on "{checkpoint["scenarios"]}"'
+            )
+        try:
+            output_size = os.path.getsize(self.output)
+        except FileNotFoundError:
+            output_size = 0
+        if output_size < checkpoint['output_size']:
+            raise ValueError(
+                f'Results file {self.output} is shorter than recorded in {self.path}'
+            )
+        self.offset = checkpoint['offset']
+        self.kpis = checkpoint['kpis']
+        with open(self.output, 'a') as fp:
+            fp.truncate(checkpoint['output_size'])
+
+    def save(self):
+        checkpoint = {
+            'policy': self.policy,
+            'scenarios': self.scenarios,
+            'offset': self.offset,
+            'kpis': self.kpis,
+            'output_size': os.path.getsize(self.output),
+        }
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(checkpoint, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.path)
+
+    def update(self, results):
+        """Aggregate results, append them to the output file and save progress."""
+        for result in results:
+            for key in self.kpis:
+                self.kpis[key] += result[key]
+        self.offset += len(results)
+        if self.output is None:
+            return
+        with open(self.output, 'a') as fp:
+            for result in results:
+                fp.write(json.dumps(result))
+                fp.write('\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+        self.save()
+
+
+def evaluate(
+    policy,
+    scenarios,
+    host,
+    port,
+    episodes,
+    output=None,
+    checkpoint_every=100,
+    resume=False,
+):
     warehouse_sim = Simulation()
     agent = get_agent(policy, host=host, port=port)
-    kpis = {
-        'A': [],
-        'B': [],
-        'leftovers': [],
-    }
+    checkpoint = Checkpoint(output, policy, scenarios)
+    if resume:
+        if output is None:
+            raise ValueError('Resuming an evaluation requires an output file')
+        checkpoint.load()
+        if 0 <= episodes < checkpoint.offset:
+            raise ValueError(
+                f'Checkpoint {checkpoint.path} already covers {checkpoint.offset} '
+                f'scenarios, more than the {episodes} requested'
+            )
+    elif output is not None:
+        open(output, 'w').close()
+        try:
+            os.remove(checkpoint.path)
+        except FileNotFoundError:
+            pass
 
+    results = []
     with open(scenarios, 'r') as fp:
-        scenarios = fp.readlines()
+        lines = islice(fp, checkpoint.offset, episodes if episodes >= 0 else None)
+        for scenario_id, scenario in enumerate(lines, start=checkpoint.offset):
+            config = json.loads(scenario)
+            results.append(
+                {'scenario': scenario_id, **run_episode(warehouse_sim, agent, config)}
+            )
+            if len(results) >= checkpoint_every:
+                checkpoint.update(results)
+                results = []
+    checkpoint.update(results)
+
+    if checkpoint.offset == 0:
+        print('No scenarios evaluated')
+        return
+    for key, val in checkpoint.kpis.items():
+        print(f'{key}: ', val / checkpoint.offset)
+
+
+def compare(policies, scenarios, host, port, episodes):
+    """Evaluate several policies on the same scenarios.
+
+    The start state of each scenario, including its random parts, is built
+    once and then played by every policy in parallel, each with its own
+    simulation and agent. Differences are paired per scenario and computed with
+    respect to the first policy.
+    """
+    policies = list(dict.fromkeys(policies))
+    builder = Simulation(verbose=False)
+    players = {
+        policy: (Simulation(verbose=False), get_agent(policy, host=host, port=port))
+        for policy in policies
+    }
+    kpis = {policy: {'A': [], 'B': [], 'leftovers': []} for policy in policies}
+
+    def play(policy, config, start_state):
+        warehouse_sim, agent = players[policy]
+        return policy, run_episode(warehouse_sim, agent, config, start_state)
 
-    if episodes < 0:
-        episodes = len(scenarios)
+    with open(scenarios, 'r') as fp, ThreadPoolExecutor(len(policies)) as executor:
+        for scenario in islice(fp, episodes if episodes >= 0 else None):
+            config = json.loads(scenario)
+            start_state = builder.build_start_state(config)
+            results = executor.map(
+                play,
+                policies,
+                [config] * len(policies),
+                [start_state] * len(policies),
+            )
+            for policy, result in results:
+                for key, val in kpis[policy].items():
+                    val.append(result[key])
 
-    for scenario in scenarios[:episodes]:
-        config = json.loads(scenario)
-        state = clean_state(warehouse_sim.episode_start(config))
-        leftover = 0
+    if not kpis[policies[0]]['A']:
+        print('No scenarios evaluated')
+        return
 
-        for _ in range(config['total_pos']):
-            if state['available_bins'] <= 0:
-                leftover = state['remaining_products']
-                break
-            action = agent.action(state)
-            state = clean_state(warehouse_sim.episode_step(action))
-        kpis['A'].append(state['A'])
-        kpis['B'].append(state['B'])
-        kpis['leftovers'].append(leftover)
-        agent.reset()
+    print('| Policy                       | ``A`` | ``B`` | Leftovers |')
+    print('| ---------------------------- |:-----:|:-----:|:---------:|')
+    for policy in policies:
+        a, b, leftovers = (statistics.mean(val) for val in kpis[policy].values())
+        print(f'| {policy.capitalize():28} | {a:.2f}  | {b:.2f}  | {leftovers:<9.2f} |')
 
-    for key, val in kpis.items():
-        print(f'{key}: ', statistics.mean(val))
+    baseline = policies[0]
+    for policy in policies[1:]:
+        print(f'\nPaired differences {policy} - {baseline}:')
+        for key, val in kpis[policy].items():
+            diffs = [x - y for x, y in zip(val, kpis[baseline][key])]
+            mean = statistics.mean(diffs)
+            stderr = (
+                statistics.stdev(diffs) / len(diffs) ** 0.5 if len(diffs) > 1 else 0.
+            )
+            print(f'{key}: ', f'{mean:.4f} +/- {stderr:.4f}')
 
 
 def main():
     args = parser.parse_args()
-    if args.policy:
+    if args.checkpoint_every < 1:
+        parser.error('--checkpoint-every must be at least 1')
+    if args.compare:
+        conflicts = [
+            option
+            for option, value in (
+                ('--policy', args.policy),
+                ('--output', args.output),
+                ('--resume', args.resume),
+            )
+            if value
+        ]
+        if conflicts:
+            parser.error(f'--compare cannot be used with {", ".join(conflicts)}')
+        compare(
+            policies=args.compare,
+            scenarios=args.scenarios,
+            host=args.host,
+            port=args.port,
+            episodes=args.episodes,
+        )
+    elif args.policy:
         evaluate(
             policy=args.policy,
             scenarios=args.scenarios,
             host=args.host,
             port=args.port,
             episodes=args.episodes,
+            output=args.output,
+            checkpoint_every=args.checkpoint_every,
+            resume=args.resume,
         )
     elif args.generate_scenarios:
         generate_scenarios(args.episodes)
@@ -1,29 +1,30 @@
 import json
+import random
 
 from warehouse.sim import AVAILABLE_BINS, get_random_po
 
 
-def init_bins():
+def init_bins(rng=random):
     for bin_ in AVAILABLE_BINS:
-        po = get_random_po(int(0.5 * bin_.capacity))
+        po = get_random_po(int(0.5 * bin_.capacity), rng)
         yield {'bin': bin_.code, 'product': po.product.sku, 'quantity': po.quantity}
 
 
-def init_pos():
+def init_pos(rng=random):
     for _ in range(20):
-        po = get_random_po(10)
+        po = get_random_po(10, rng)
         yield {
             'product': po.product.sku,
             'quantity': po.quantity,
         }
 
 
-def generate_scenario():
-    bins = {bin_['bin']: bin_ for bin_ in init_bins()}
+def generate_scenario(rng=random):
+    bins = {bin_['bin']: bin_ for bin_ in init_bins(rng)}
     return {
         'total_pos': 10,
         'init_bins': bins,
-        'pos': [po for po in init_pos()],
+        'pos': [po for po in init_pos(rng)],
     }
 
 
@@ -1,7 +1,8 @@
 import dataclasses
 import random
-from collections import OrderedDict
-from typing import Dict, List, Optional
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sized
 
 from bonsai_connector.connector import BonsaiEventType
 
@@ -65,7 +66,7 @@ class Bin:
 class Warehouse:
     def __init__(self, bins: List[Bin]):
         self._bins = OrderedDict({bin_.code: bin_ for bin_ in bins})
-        self.areas = set(bin_.area for bin_ in bins)
+        self.areas = sorted(set(bin_.area for bin_ in bins))
 
     @property
     def bins(self):
@@ -100,22 +101,110 @@ AVAILABLE_BINS = [
 ]
 
 
-def get_random_po(max_quantity):
-    return PO(random.choice(AVAILABLE_PRODUCTS), random.randint(1, max_quantity))
+def get_random_po(max_quantity, rng=random):
+    return PO(rng.choice(AVAILABLE_PRODUCTS), rng.randint(1, max_quantity))
+
+
+def get_planned_pos(max_quantity, total_pos, window_size, rng=random):
+    return POQueue(
+        (get_random_po(max_quantity, rng) for _ in range(total_pos)),
+        window_size,
+        total_pos,
+    )
+
+
+class POQueue:
+    """Queue of planned POs with a look-ahead window.
+
+    POs are pulled lazily from ``pos``, which can be any iterable, so that long
+    episodes do not need to be materialised up front. Only the POs in the
+    look-ahead window, and at least the next PO, are buffered. Advancing the
+    queue is O(1) and ``window`` iterates over the buffer without copying it.
+    """
+    def __init__(self, pos: Iterable[PO], window: int, length: Optional[int] = None):
+        if length is None:
+            try:
+                length = len(pos)  # type: ignore[arg-type]
+            except TypeError:
+                raise ValueError('Length must be given for POs without len()')
+        if window < 0:
+            raise ValueError(f'Window size must be non-negative, got {window}')
+        self._pos: Iterator[PO] = iter(pos)
+        self._declared_length = length
+        self._length = length
+        self._buffer: deque = deque()
+        self.window_size = window
+        self._fill()
+
+    def _fill(self):
+        while len(self._buffer) < min(max(self.window_size, 1), self._length):
+            try:
+                self._buffer.append(next(self._pos))
+            except StopIteration:
+                pulled = self._declared_length - self._length + len(self._buffer)
+                raise ValueError(
+                    'Not enough POs provided. '
+                    f'Minimum {self._declared_length} got {pulled}.'
+                )
+
+    def __len__(self):
+        return self._length
+
+    def pop(self) -> PO:
+        """Return the next PO and move the window one step ahead."""
+        if not self._buffer:
+            raise IndexError('pop from empty POQueue')
+        po = self._buffer.popleft()
+        self._length -= 1
+        self._fill()
+        return po
+
+    @property
+    def window(self) -> Iterator[PO]:
+        """Iterate over the POs coming next, up to the window size."""
+        return islice(self._buffer, self.window_size)
+
+    def drain(self) -> List[PO]:
+        """Pop all remaining POs."""
+        return [self.pop() for _ in range(len(self))]
 
 
-def get_planned_pos(max_quantity, total_pos):
-    return [get_random_po(max_quantity) for _ in range(total_pos)]
+@dataclasses.dataclass
+class StartState:
+    """Resolved start of an episode that can be loaded in several simulations."""
+    bins: Dict[str, PO]
+    pos: List[PO]
 
 
 class Simulation:
     next_po: PO
     config: Dict
-    pos: List
+    pos: POQueue
     _state: Dict
 
-    def __init__(self):
-        self.warehouse = Warehouse(AVAILABLE_BINS)
+    def __init__(
+        self,
+        window_size: int = 10,
+        max_pos: int = 20,
+        verbose: bool = True,
+        rng: Optional[random.Random] = None,
+    ):
+        """Create a simulation.
+
+        ``window_size`` is the number of coming POs exposed in the state and
+        ``max_pos`` is the maximum number of POs that can be passed in the
+        config. Both are part of the Bonsai interface. ``verbose`` controls
+        logging at the start of each episode. Random bins and POs are drawn
+        from ``rng``, or from the global ``random`` module if not given.
+        """
+        # Copy the bins, so that simulations do not share the warehouse state
+        self.warehouse = Warehouse(
+            [dataclasses.replace(bin_) for bin_ in AVAILABLE_BINS]
+        )
+        self.window_size = window_size
+        self.max_pos = max_pos
+        self.verbose = verbose
+        self.rng = random if rng is None else rng
 
     @property
     def interface(self):
@@ -178,7 +267,7 @@ class Simulation:
                             'name': 'coming_pos',
                             'type': {
                                 'category': 'Array',
-                                'length': 10,
+                                'length': self.window_size,
                                 'type': {
                                     'category': 'Struct',
                                     'fields': [
@@ -274,7 +363,7 @@ class Simulation:
                             'comment': 'Make this array long enough to complete an episode',  # noqa
                             'type': {
                                 'category': 'Array',
-                                'length': 20,
+                                'length': self.max_pos,
                                 'type': {
                                     'category': 'Struct',
                                     'fields': [
@@ -307,26 +396,39 @@ class Simulation:
                 po = PO(product, bin_content['quantity'])
                 self.warehouse.store_po(bin_, po)
         else:
-            print('Init config for bins not found. Generating randomly...')
+            if self.verbose:
+                print('Init config for bins not found. Generating randomly...')
             for bin_ in self.warehouse.bins:
                 max_quantity = self.config['max_quantity']
                 po = get_random_po(
-                    max_quantity if max_quantity < bin_.capacity else bin_.capacity
+                    max_quantity if max_quantity < bin_.capacity else bin_.capacity,
+                    self.rng,
                 )
                 bin_.store_po(po)
 
     def init_planned_pos(self):
         if init_pos := self.config.get('pos'):
-            pos = []
-            for entry in reversed(init_pos):
-                product = Product(entry['product'])
-                if product not in AVAILABLE_PRODUCTS:
-                    raise ValueError(f'Product {product} not in available products')
-                pos.append(PO(product, entry['quantity']))
+            if isinstance(init_pos, Sized):
+                pos = POQueue(
+                    [self.parse_po(entry) for entry in init_pos], self.window_size
+                )
+            else:
+                # Streamed POs are parsed as they enter the look-ahead window.
+                # Their total is unknown, so the queue, and remaining_products
+                # in the state, are bounded by total_pos
+                pos = POQueue(
+                    (self.parse_po(entry) for entry in init_pos),
+                    self.window_size,
+                    self.config['total_pos'],
+                )
         else:
-            print('Init POs plan not found. Generating randomly...')
+            if self.verbose:
+                print('Init POs plan not found. Generating randomly...')
             pos = get_planned_pos(
-                self.config['max_quantity'], 2 * self.config['total_pos'] + 1
+                self.config['max_quantity'],
+                2 * self.config['total_pos'] + 1,
+                self.window_size,
+                self.rng,
             )
         if len(pos) < self.config['total_pos']:
             raise ValueError(
@@ -335,6 +437,13 @@ class Simulation:
             )
         self.pos = pos
 
+    @staticmethod
+    def parse_po(entry):
+        product = Product(entry['product'])
+        if product not in AVAILABLE_PRODUCTS:
+            raise ValueError(f'Product {product} not in available products')
+        return PO(product, entry['quantity'])
+
     def empty_warehouse(self):
         for bin_ in self.warehouse.bins:
             bin_.product = None
@@ -344,7 +453,7 @@ class Simulation:
         try:
             self.next_po = self.pos.pop()
         except IndexError:
-            self.next_po = PO(random.choice(AVAILABLE_PRODUCTS), 0)
+            self.next_po = PO(self.rng.choice(AVAILABLE_PRODUCTS), 0)
 
     def compute_mask(self):
         mask = [
@@ -370,7 +479,7 @@ class Simulation:
     def update_state(self):
         coming_pos = [
             {'product': AVAILABLE_PRODUCTS.index(po.product), 'quantity': po.quantity}
-            for po in reversed(self.pos[-10:])
+            for po in self.pos.window
         ]
         bin_avail = []
         area_occs = {}
@@ -398,13 +507,37 @@ class Simulation:
             "halted": False,
         }
 
-    def episode_start(self, config):
+    def build_start_state(self, config) -> StartState:
+        """Resolve bins and POs for config, including random ones, only once."""
         self.config = config
-        print('Intializing episode...')
-        print('Config:', self.config)
         self.empty_warehouse()
         self.init_warehouse()
         self.init_planned_pos()
+        return StartState(
+            bins={
+                bin_.code: PO(bin_.product, bin_.occupation)
+                for bin_ in self.warehouse.bins
+                if bin_.product is not None
+            },
+            pos=self.pos.drain(),
+        )
+
+    def load_start_state(self, start_state: StartState):
+        for bin_, po in start_state.bins.items():
+            self.warehouse.store_po(bin_, po)
+        self.pos = POQueue(start_state.pos, self.window_size)
+
+    def episode_start(self, config, start_state: Optional[StartState] = None):
+        self.config = config
+        if self.verbose:
+            print('Intializing episode...')
+            print('Config:', self.config)
+        self.empty_warehouse()
+        if start_state is None:
+            self.init_warehouse()
+            self.init_planned_pos()
+        else:
+            self.load_start_state(start_state)
         self.set_next_po()
         self.update_state()
         return self.state
@@ -0,0 +1,307 @@
+"""Vectorized environment to train local agents against the simulation."""
+import multiprocessing
+import random
+from itertools import islice
+
+import numpy as np
+from gymnasium import spaces
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from warehouse.scenario_generator import generate_scenario
+from warehouse.sim import Simulation
+
+PADDING = -1
+
+
+def type_size(type_):
+    """Return the number of values needed to store a type of the interface."""
+    category = type_['category']
+    if category == 'Number':
+        return 1
+    if category == 'Array':
+        return type_['length'] * type_size(type_['type'])
+    if category == 'Struct':
+        return sum(type_size(field['type']) for field in type_['fields'])
+    raise ValueError(f'Unsupported category {category}')
+
+
+def write_value(type_, value, out, offset=0):
+    """Write value in out starting at offset and return the next offset.
+
+    Arrays shorter than their length in the interface are padded with -1.
+    """
+    category = type_['category']
+    if category == 'Number':
+        out[offset] = value
+        return offset + 1
+    if category == 'Array':
+        end = offset + type_size(type_)
+        for item in islice(value, type_['length']):
+            offset = write_value(type_['type'], item, out, offset)
+        out[offset:end] = PADDING
+        return end
+    if category == 'Struct':
+        for field in type_['fields']:
+            offset = write_value(field['type'], value[field['name']], out, offset)
+        return offset
+    raise ValueError(f'Unsupported category {category}')
+
+
+def spaces_from_interface(interface):
+    """Return observation and action spaces of a single simulation."""
+    description = interface['description']
+    observation_space = spaces.Box(
+        low=PADDING,
+        high=np.inf,
+        shape=(type_size(description['state']),),
+        dtype=np.float32,
+    )
+    action_fields = description['action']['fields']
+    if len(action_fields) != 1:
+        raise ValueError('Only actions with a single field are supported')
+    action_space = spaces.Discrete(len(action_fields[0]['type']['namedValues']))
+    return observation_space, action_space
+
+
+def buffer_specs(num_envs, observation_size, n_actions):
+    """Return shape and dtype of the buffers shared by the environments."""
+    return {
+        'observations': ((num_envs, observation_size), np.float32),
+        'final_observations': ((num_envs, observation_size), np.float32),
+        'action_masks': ((num_envs, n_actions), np.bool_),
+        'actions': ((num_envs,), np.int64),
+        'rewards': ((num_envs,), np.float32),
+        'terminations': ((num_envs,), np.bool_),
+        'truncations': ((num_envs,), np.bool_),
+    }
+
+
+class Runner:
+    """Play a batch of simulations, writing their results in buffers.
+
+    The buffers are the rows of the ``buffer_specs`` arrays assigned to this
+    runner, starting from the environment ``offset``. Each environment draws
+    its configs and POs from its own random generator, seeded with
+    ``seed + index`` at reset. An episode ends when all POs have been allocated
+    or no bin is available, as in the evaluation of the policies. Finished
+    episodes are reset straight away and their last observation is written in
+    ``final_observations``.
+    """
+    def __init__(self, num_envs, config_fn, buffers, window_size, max_pos, offset=0):
+        self.rngs = [random.Random() for _ in range(num_envs)]
+        self.sims = [
+            Simulation(window_size, max_pos, verbose=False, rng=rng)
+            for rng in self.rngs
+        ]
+        self.offset = offset
+        self.state_type = self.sims[0].interface['description']['state']
+        self.config_fn = config_fn
+        self.buffers = buffers
+        self.steps = [0] * num_envs
+
+    def write_state(self, idx, state, observations):
+        write_value(self.state_type, state, observations[idx])
+        self.buffers['action_masks'][idx] = state['mask']
+
+    def reset_env(self, idx):
+        state = self.sims[idx].episode_start(self.config_fn(self.rngs[idx]))
+        self.steps[idx] = 0
+        self.write_state(idx, state, self.buffers['observations'])
+
+    def reset(self, seed=None):
+        for idx, rng in enumerate(self.rngs):
+            if seed is not None:
+                rng.seed(seed + self.offset + idx)
+            self.reset_env(idx)
+
+    def step(self):
+        for idx, sim in enumerate(self.sims):
+            occupation = sim.state['A']
+            state = sim.episode_step({'bin': int(self.buffers['actions'][idx])})
+            self.steps[idx] += 1
+            terminated = (
+                state['available_bins'] <= 0 or
+                self.steps[idx] >= sim.config['total_pos']
+            )
+            self.buffers['rewards'][idx] = state['A'] - occupation
+            self.buffers['terminations'][idx] = terminated
+            self.buffers['truncations'][idx] = False
+            if terminated:
+                self.write_state(idx, state, self.buffers['final_observations'])
+                self.reset_env(idx)
+            else:
+                self.write_state(idx, state, self.buffers['observations'])
+
+
+def shared_buffers(specs):
+    """Allocate buffers in shared memory, to be passed to the workers."""
+    return {
+        key: multiprocessing.RawArray(
+            np.ctypeslib.as_ctypes_type(dtype), int(np.prod(shape))
+        )
+        for key, (shape, dtype) in specs.items()
+    }
+
+
+def as_arrays(specs, raw_buffers):
+    """Return NumPy views on the shared buffers."""
+    return {
+        key: np.frombuffer(raw_buffers[key], dtype=dtype).reshape(shape)
+        for key, (shape, dtype) in specs.items()
+    }
+
+
+def worker(conn, specs, raw_buffers, start, stop, config_fn, window_size, max_pos):
+    """Run the environments start:stop in a subprocess."""
+    buffers = {
+        key: array[start:stop] for key, array in as_arrays(specs, raw_buffers).items()
+    }
+    runner = Runner(stop - start, config_fn, buffers, window_size, max_pos, start)
+    try:
+        while True:
+            command, data = conn.recv()
+            if command == 'close':
+                break
+            try:
+                if command == 'reset':
+                    runner.reset(data)
+                elif command == 'step':
+                    runner.step()
+                else:
+                    raise RuntimeError(f'Unexpected command {command}')
+            except Exception as exc:
+                conn.send(exc)
+            else:
+                conn.send(None)
+    finally:
+        conn.close()
+
+
+class WarehouseVectorEnv(VectorEnv):
+    """Gymnasium vector environment running several warehouse simulations.
+
+    Observations are the states of the Bonsai interface flattened in a float
+    array and actions are the indices of the bins. Observations, rewards and
+    action masks are written in place in preallocated arrays, which are
+    returned without copies and overwritten by the following step. The action
+    mask is returned in ``infos['action_mask']`` and by ``action_masks()``.
+    Actions not allowed by the mask raise a ``ValueError`` before any
+    simulation is stepped.
+
+    The reward is the increase in occupation of area ``A``. Finished episodes
+    are reset in the same step, with a new config from ``config_fn``, and
+    their last observation is available in ``infos['final_obs']``.
+    ``config_fn`` is called with the random generator of the environment.
+    Seeding ``reset`` seeds environment ``i`` with ``seed + i``, without
+    touching the global ``random`` module.
+
+    With ``workers=0`` the simulations run in the current process. Otherwise
+    they are split among subprocesses that write in shared memory.
+    """
+    metadata = {'autoreset_mode': AutoresetMode.SAME_STEP}
+
+    def __init__(
+        self,
+        num_envs,
+        config_fn=generate_scenario,
+        workers=0,
+        window_size=10,
+        max_pos=20,
+    ):
+        self.num_envs = num_envs
+        interface = Simulation(window_size, max_pos, verbose=False).interface
+        self.single_observation_space, self.single_action_space = (
+            spaces_from_interface(interface)
+        )
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        specs = buffer_specs(
+            num_envs,
+            self.single_observation_space.shape[0],
+            self.single_action_space.n,
+        )
+
+        self.processes = []
+        self.conns = []
+        if workers:
+            raw_buffers = shared_buffers(specs)
+            self.buffers = as_arrays(specs, raw_buffers)
+            bounds = np.linspace(0, num_envs, min(workers, num_envs) + 1, dtype=int)
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                conn, child_conn = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=worker,
+                    args=(
+                        child_conn, specs, raw_buffers, int(start), int(stop),
+                        config_fn, window_size, max_pos,
+                    ),
+                    daemon=True,
+                )
+                process.start()
+                child_conn.close()
+                self.processes.append(process)
+                self.conns.append(conn)
+            self.runner = None
+        else:
+            self.buffers = {
+                key: np.zeros(shape, dtype=dtype)
+                for key, (shape, dtype) in specs.items()
+            }
+            self.runner = Runner(
+                num_envs, config_fn, self.buffers, window_size, max_pos
+            )
+        self.env_indices = np.arange(num_envs)
+
+    def send(self, command, data=None):
+        for conn in self.conns:
+            conn.send((command, data))
+        errors = [conn.recv() for conn in self.conns]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def action_masks(self):
+        return self.buffers['action_masks']
+
+    def infos(self, final=None):
+        infos = {'action_mask': self.buffers['action_masks']}
+        if final is not None and final.any():
+            infos['final_obs'] = self.buffers['final_observations']
+            infos['_final_obs'] = final
+        return infos
+
+    def reset(self, *, seed=None, options=None):
+        if self.runner is not None:
+            self.runner.reset(seed)
+        else:
+            self.send('reset', seed)
+        return self.buffers['observations'], self.infos()
+
+    def step(self, actions):
+        self.buffers['actions'][:] = actions
+        actions = self.buffers['actions']
+        if (
+            ((actions < 0) | (actions >= self.single_action_space.n)).any() or
+            not self.buffers['action_masks'][self.env_indices, actions].all()
+        ):
+            raise ValueError(f'Actions {actions} not allowed by the action masks')
+        if self.runner is not None:
+            self.runner.step()
+        else:
+            self.send('step')
+        final = self.buffers['terminations'] | self.buffers['truncations']
+        return (
+            self.buffers['observations'],
+            self.buffers['rewards'],
+            self.buffers['terminations'],
+            self.buffers['truncations'],
+            self.infos(final),
+        )
+
+    def close_extras(self, **kwargs):
+        for conn in self.conns:
+            conn.send(('close', None))
+            conn.close()
+        for process in self.processes:
+            process.join()